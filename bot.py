@@ -1,11 +1,19 @@
 import os
 import json
 import base64
+import hashlib
+import hmac
+import queue
 import random
+import socket
+import threading
 import time
+from collections import deque
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
 
 from zoneinfo import ZoneInfo
 import tweepy
@@ -48,11 +56,34 @@ TIME_WINDOWS = [
 ENABLE_LIKE_BACK = True          # いいね返し
 ENABLE_DISCOVERY_LIKES = True    # 関連ユーザーへのいいね撒き
 ENABLE_SMART_REPLIES = True      # 自然リプ（ごく少なめ）
+ENABLE_MENTION_LIKES = True      # メンションへのいいね（Webhook モードのみ）
+ENABLE_MENTION_REPLIES = True    # メンションへの短い返信（Webhook モードのみ）
 
 LIKE_BACK_LIMIT_PER_RUN = 10         # 1回の実行で返す「いいね」の最大数
 DISCOVERY_LIKE_LIMIT_PER_RUN = 10    # 関連ツイートへ押す「いいね」の最大数
 REPLY_LIMIT_PER_RUN = 2              # 1回の実行で送るリプの最大数
 
+# ==========================
+# Webhook（イベント駆動）モード設定
+# ==========================
+# 環境変数 WEBHOOK_MODE=true にすると、いいね返しはポーリングではなく
+# Account Activity 形式の Webhook で受けたイベントで行う（cron 側のいいね返しは止まる）
+# Webhook を受けるサーバー自体は WEBHOOK_SERVER=true で起動する
+ENABLE_WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "false").lower() == "true"
+RUN_WEBHOOK_SERVER = os.getenv("WEBHOOK_SERVER", "false").lower() == "true"
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+
+# 常駐プロセスなので「1回の実行」ではなく「1時間あたり」で上限をかける
+WEBHOOK_LIKE_LIMIT_PER_HOUR = 30     # 1時間に押す「いいね」の最大数
+WEBHOOK_REPLY_LIMIT_PER_HOUR = 2     # 1時間に送るリプの最大数
+WEBHOOK_USER_COOLDOWN_SEC = 60 * 60  # 同じ人へのいいね返しは1時間に1回まで
+WEBHOOK_MENTION_MEMORY_SEC = 24 * 60 * 60  # 対応済みメンションを覚えておく時間（再送対策）
+WEBHOOK_MEMORY_MAX = 10000           # 覚えておく件数の上限（古いものから忘れる）
+WEBHOOK_MAX_BODY_BYTES = 1024 * 1024  # 受け付ける POST 本文の最大サイズ（1MB）
+WEBHOOK_SOCKET_TIMEOUT_SEC = 10      # 1接続の読み書きがこれ以上止まったら切る
+
 # 画像保存先（すでにある BOTimg フォルダを利用）
 BASE_DIR = Path(__file__).resolve().parent
 IMG_DIR = BASE_DIR / "BOTimg"
@@ -419,6 +450,33 @@ def choose_today_target_time(now: datetime) -> datetime:
 # ==========================
 # いいね返し機能
 # ==========================
+def like_latest_tweet_of(client: tweepy.Client, user_id) -> bool:
+    """相手の最新ツイート（RT・リプ以外）に1つだけいいねする。成功したら True。"""
+    try:
+        user_tweets = client.get_users_tweets(
+            id=user_id,
+            max_results=5,
+            exclude=["retweets", "replies"],
+            tweet_fields=["id"],
+        )
+    except Exception as e:
+        print("いいね返し: 相手ツイート取得でエラー:", e)
+        return False
+
+    if not user_tweets.data:
+        return False
+
+    target_tweet_id = user_tweets.data[0].id
+
+    try:
+        client.like(target_tweet_id)
+        print(f"いいね返し: user={user_id} tweet={target_tweet_id}")
+        return True
+    except Exception as e:
+        print("いいね返し: likeでエラー:", e)
+        return False
+
+
 def like_back_recent_likers() -> None:
     """自分のツイートにいいねしてくれた人の最新ツイートに、いいね返しをする。"""
     if not ENABLE_LIKE_BACK:
@@ -458,29 +516,8 @@ def like_back_recent_likers() -> None:
             if liked_count >= LIKE_BACK_LIMIT_PER_RUN:
                 return
 
-            try:
-                user_tweets = client.get_users_tweets(
-                    id=user.id,
-                    max_results=5,
-                    exclude=["retweets", "replies"],
-                    tweet_fields=["id"],
-                )
-            except Exception as e:
-                print("いいね返し: 相手ツイート取得でエラー:", e)
-                continue
-
-            if not user_tweets.data:
-                continue
-
-            target_tweet_id = user_tweets.data[0].id
-
-            try:
-                client.like(target_tweet_id)
+            if like_latest_tweet_of(client, user.id):
                 liked_count += 1
-                print(f"いいね返し: user={user.id} tweet={target_tweet_id}")
-            except Exception as e:
-                print("いいね返し: likeでエラー:", e)
-                continue
 
 
 # ==========================
@@ -616,6 +653,363 @@ def smart_replies() -> None:
             continue
 
 
+# ==========================
+# Webhook（イベント駆動）でのいいね返し・メンション対応
+# ==========================
+# Webhook で受けたイベントはここに積んで、別スレッドで順番に処理する
+ENGAGEMENT_QUEUE: "queue.Queue[Dict[str, str]]" = queue.Queue()
+
+# 1時間あたりの上限チェック用（押した時刻を覚えておく）
+webhook_like_history: Deque[float] = deque()
+webhook_reply_history: Deque[float] = deque()
+webhook_last_liked_user: Dict[str, float] = {}
+
+# 対応済みメンション（tweet_id -> 対応した時刻）。再送・二重リプレイで二度反応しないため
+webhook_handled_mentions: Dict[str, float] = {}
+
+
+def as_dict(value) -> dict:
+    """dict 以外（None など）は空の dict として扱う。"""
+    return value if isinstance(value, dict) else {}
+
+
+def as_list(value) -> list:
+    """list 以外（None など）は空の list として扱う。"""
+    return value if isinstance(value, list) else []
+
+
+def parse_activity_events(payload: dict) -> List[Dict[str, str]]:
+    """
+    Account Activity 形式の payload から、反応したいイベントだけを取り出す。
+    - favorite_events   -> {"type": "like", "user_id", "tweet_id"}
+    - tweet_create_events のうち自分宛てメンション
+                        -> {"type": "mention", "user_id", "tweet_id", "text"}
+    自分自身の行動（自分のいいね・自分のツイート）は無視する。
+    """
+    if not isinstance(payload, dict):
+        return []
+
+    # 誰宛てのイベントか分からないと、メンション判定も自分の行動の除外もできない
+    my_id = str(payload.get("for_user_id") or "")
+    if not my_id:
+        return []
+
+    events: List[Dict[str, str]] = []
+
+    # 形のおかしいイベントは飛ばすだけで、残りは処理する
+    for fav in as_list(payload.get("favorite_events")):
+        if not isinstance(fav, dict):
+            continue
+        user_id = str(as_dict(fav.get("user")).get("id_str") or "")
+        tweet_id = str(as_dict(fav.get("favorited_status")).get("id_str") or "")
+        if not user_id or user_id == my_id:
+            continue
+        events.append({"type": "like", "user_id": user_id, "tweet_id": tweet_id})
+
+    for tweet in as_list(payload.get("tweet_create_events")):
+        if not isinstance(tweet, dict):
+            continue
+        user_id = str(as_dict(tweet.get("user")).get("id_str") or "")
+        tweet_id = str(tweet.get("id_str") or "")
+        if not user_id or not tweet_id or user_id == my_id or "retweeted_status" in tweet:
+            continue
+
+        mentions = as_list(as_dict(tweet.get("entities")).get("user_mentions"))
+        mention_ids = [str(as_dict(m).get("id_str") or "") for m in mentions]
+        if my_id not in mention_ids:
+            continue
+
+        text = as_dict(tweet.get("extended_tweet")).get("full_text") or tweet.get("text") or ""
+        events.append({
+            "type": "mention",
+            "user_id": user_id,
+            "tweet_id": tweet_id,
+            "text": str(text),
+        })
+
+    return events
+
+
+def enqueue_activity_payload(payload: dict) -> int:
+    """payload をイベントに分解してキューに積む。積んだ件数を返す。"""
+    events = parse_activity_events(payload)
+    for event in events:
+        ENGAGEMENT_QUEUE.put(event)
+    return len(events)
+
+
+def within_hourly_limit(history: Deque[float], limit: int) -> bool:
+    """直近1時間の実行回数が limit 未満なら True。"""
+    now = time.time()
+    while history and now - history[0] > 60 * 60:
+        history.popleft()
+    return len(history) < limit
+
+
+def forget_old_entries(memory: Dict[str, float], max_age_sec: float) -> None:
+    """max_age_sec より古い記録と、WEBHOOK_MEMORY_MAX を超えた古い記録を消す。"""
+    now = time.time()
+    for key in [k for k, t in memory.items() if now - t > max_age_sec]:
+        del memory[key]
+
+    # dict は追加順なので、先頭から消せば古いものから忘れる
+    while len(memory) > WEBHOOK_MEMORY_MAX:
+        del memory[next(iter(memory))]
+
+
+def handle_engagement_event(client: Optional[tweepy.Client], event: Dict[str, str]) -> None:
+    """
+    キューから取り出したイベント1件に反応する。
+    client が None のときはドライラン（APIは叩かずにログだけ出す）。
+    """
+    dry_run = client is None
+    user_id = event.get("user_id", "")
+
+    if event.get("type") == "like":
+        if not ENABLE_LIKE_BACK:
+            return
+
+        forget_old_entries(webhook_last_liked_user, WEBHOOK_USER_COOLDOWN_SEC)
+        last = webhook_last_liked_user.get(user_id)
+        if last is not None and time.time() - last < WEBHOOK_USER_COOLDOWN_SEC:
+            return
+        if not within_hourly_limit(webhook_like_history, WEBHOOK_LIKE_LIMIT_PER_HOUR):
+            print("Webhook: いいねの上限に達したのでスキップ")
+            return
+
+        if dry_run:
+            print(f"[DRY RUN] いいね返し: user={user_id}")
+        elif not like_latest_tweet_of(client, user_id):
+            return
+
+        webhook_like_history.append(time.time())
+        webhook_last_liked_user.pop(user_id, None)
+        webhook_last_liked_user[user_id] = time.time()
+        return
+
+    if event.get("type") == "mention":
+        tweet_id = event.get("tweet_id", "")
+        text = event.get("text", "")
+
+        # 同じメンションには一度だけ反応する（Webhook の再送・二重リプレイ対策）
+        forget_old_entries(webhook_handled_mentions, WEBHOOK_MENTION_MEMORY_SEC)
+        if tweet_id in webhook_handled_mentions:
+            return
+
+        succeeded = False
+        failed = False
+
+        # メンションにはまず「いいね」
+        if ENABLE_MENTION_LIKES and within_hourly_limit(
+            webhook_like_history, WEBHOOK_LIKE_LIMIT_PER_HOUR
+        ):
+            try:
+                if dry_run:
+                    print(f"[DRY RUN] メンションにいいね: tweet={tweet_id}")
+                else:
+                    client.like(tweet_id)
+                    print(f"メンションにいいね: tweet={tweet_id}")
+                webhook_like_history.append(time.time())
+                succeeded = True
+            except Exception as e:
+                print("Webhook: メンションへのlikeでエラー:", e)
+                failed = True
+
+        # リプは控えめに（URL付きは避ける）
+        should_reply = (
+            ENABLE_MENTION_REPLIES
+            and "http://" not in text
+            and "https://" not in text
+            and within_hourly_limit(webhook_reply_history, WEBHOOK_REPLY_LIMIT_PER_HOUR)
+        )
+        if should_reply:
+            try:
+                replied = False
+                if dry_run:
+                    print(f"[DRY RUN] メンションにリプ: tweet={tweet_id} text={text}")
+                    replied = True
+                else:
+                    reply_text = generate_short_reply(text)
+                    if reply_text:
+                        client.create_tweet(
+                            text=reply_text,
+                            reply={"in_reply_to_tweet_id": tweet_id},
+                        )
+                        print(f"メンションにリプ: tweet={tweet_id}")
+                        replied = True
+                if replied:
+                    webhook_reply_history.append(time.time())
+                    succeeded = True
+            except Exception as e:
+                print("Webhook: メンションへのリプでエラー:", e)
+                failed = True
+
+        # 一時的なエラーで全部失敗したときは「対応済み」にせず、再送・リプレイで再挑戦できるようにする
+        if succeeded or not failed:
+            webhook_handled_mentions[tweet_id] = time.time()
+
+
+def engagement_worker(client: Optional[tweepy.Client]) -> None:
+    """キューを待ち続けて、届いたイベントから順番に処理する（常駐スレッド用）。"""
+    while True:
+        event = ENGAGEMENT_QUEUE.get()
+        try:
+            handle_engagement_event(client, event)
+        except Exception as e:
+            print("Webhook: イベント処理でエラー:", e)
+        finally:
+            ENGAGEMENT_QUEUE.task_done()
+
+
+def make_webhook_signature(message: bytes) -> str:
+    """
+    consumer secret で HMAC-SHA256 した値（"sha256=..." 形式）。
+    CRC チェックの response_token と、POST 本文の署名検証の両方で使う。
+    """
+    if not API_SECRET:
+        raise RuntimeError("API_SECRET が未設定のため Webhook の署名を作れません")
+    digest = hmac.new(API_SECRET.encode("utf-8"), message, hashlib.sha256).digest()
+    return "sha256=" + base64.b64encode(digest).decode("utf-8")
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """CRC チェック（GET）とイベント受信（POST）だけを扱う小さな受け口。"""
+
+    # 送信が途中で止まった接続でスレッドを握られ続けないよう、読み書きに時間制限をかける
+    timeout = WEBHOOK_SOCKET_TIMEOUT_SEC
+
+    def _send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path != WEBHOOK_PATH:
+            self._send_json(404, {"error": "not found"})
+            return
+
+        crc_token = parse_qs(url.query).get("crc_token", [""])[0]
+        if not crc_token:
+            self._send_json(400, {"error": "crc_token is required"})
+            return
+
+        self._send_json(200, {"response_token": make_webhook_signature(crc_token.encode("utf-8"))})
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path != WEBHOOK_PATH:
+            self._send_json(404, {"error": "not found"})
+            return
+
+        # 本文を読む前にサイズを確認する（おかしな値・大きすぎる本文は読まない）
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._send_json(400, {"error": "invalid content-length"})
+            return
+        if length < 0:
+            self._send_json(400, {"error": "invalid content-length"})
+            return
+        if length > WEBHOOK_MAX_BODY_BYTES:
+            self._send_json(413, {"error": "payload too large"})
+            return
+
+        try:
+            body = self.rfile.read(length)
+        except socket.timeout:
+            self.close_connection = True
+            return
+        if len(body) < length:
+            self._send_json(400, {"error": "incomplete body"})
+            return
+
+        # 署名は必ず検証する（署名なし・不一致の POST は X 以外からとみなして弾く）
+        signature = self.headers.get("x-twitter-webhooks-signature", "")
+        expected = make_webhook_signature(body)
+        if not signature or not hmac.compare_digest(
+            signature.encode("utf-8"), expected.encode("utf-8")
+        ):
+            self._send_json(403, {"error": "invalid signature"})
+            return
+
+        try:
+            payload = json.loads(body.decode("utf-8"))
+        except Exception:
+            self._send_json(400, {"error": "invalid json"})
+            return
+
+        if not isinstance(payload, dict):
+            self._send_json(400, {"error": "payload must be a json object"})
+            return
+
+        # 重い処理はワーカーに任せて、すぐ 200 を返す
+        count = enqueue_activity_payload(payload)
+        self._send_json(200, {"queued": count})
+
+
+def run_webhook_server() -> None:
+    """Webhook 受信サーバーとイベント処理スレッドを起動して、ずっと待ち受ける。"""
+    # 署名検証ができないまま外に口を開けないよう、API_SECRET がなければ起動しない
+    if not API_SECRET:
+        raise RuntimeError("API_SECRET が未設定のため Webhook サーバーを起動できません")
+
+    client = create_client_v2()
+    worker = threading.Thread(target=engagement_worker, args=(client,), daemon=True)
+    worker.start()
+
+    server = ThreadingHTTPServer((WEBHOOK_HOST, WEBHOOK_PORT), WebhookHandler)
+    print(f"Webhook 待ち受け開始: http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+# ==========================
+# イベントのリプレイ（テスト用）
+# ==========================
+def load_replay_payloads(path: str) -> List[dict]:
+    """
+    保存しておいた Webhook payload を読み込む。
+    JSON（1件 or リスト）と JSON Lines（1行1件）のどちらでもOK。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read()
+
+    try:
+        data = json.loads(raw)
+        return data if isinstance(data, list) else [data]
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+
+def replay_events(path: str, dry_run: bool = True) -> None:
+    """
+    ファイルの payload を Webhook で届いたのと同じ流れでキューに積み、
+    その場で全部処理する。dry_run=True なら X API は叩かない。
+    """
+    client = None if dry_run else create_client_v2()
+
+    for payload in load_replay_payloads(path):
+        if not isinstance(payload, dict):
+            print("リプレイ: JSON オブジェクトではない payload をスキップ:", payload)
+            continue
+        count = enqueue_activity_payload(payload)
+        print(f"リプレイ: {count} 件のイベントを積みました")
+
+    while not ENGAGEMENT_QUEUE.empty():
+        event = ENGAGEMENT_QUEUE.get()
+        try:
+            handle_engagement_event(client, event)
+        except Exception as e:
+            print("リプレイ: イベント処理でエラー:", e)
+        finally:
+            ENGAGEMENT_QUEUE.task_done()
+
+
 # ==========================
 # メイン処理
 # ==========================
@@ -647,6 +1041,19 @@ def run_once() -> None:
 
 
 if __name__ == "__main__":
+    # 環境変数 REPLAY_EVENTS_FILE=パス で、保存した Webhook イベントを再生して終了
+    # （REPLAY_DRY_RUN=false にしない限り X API は叩かない）
+    replay_file = os.getenv("REPLAY_EVENTS_FILE")
+    if replay_file:
+        replay_dry_run = os.getenv("REPLAY_DRY_RUN", "true").lower() != "false"
+        replay_events(replay_file, dry_run=replay_dry_run)
+        raise SystemExit(0)
+
+    # Webhook サーバーとして常駐して、いいね・メンションにその場で反応する
+    if RUN_WEBHOOK_SERVER:
+        run_webhook_server()
+        raise SystemExit(0)
+
     now = datetime.now(ZoneInfo(TIMEZONE))
 
     # 環境変数 RANDOM_DELAY=true にすると、毎回ランダムな時間まで待ってから投稿
@@ -664,6 +1071,8 @@ if __name__ == "__main__":
     run_once()
 
     # ② エンゲージメント系（控えめ）
-    like_back_recent_likers()
+    # Webhook モードではいいね返しは Webhook 側が担当するので、ポーリングはしない
+    if not ENABLE_WEBHOOK_MODE:
+        like_back_recent_likers()
     like_discovery_tweets()
     smart_replies()